@@ -16,10 +16,15 @@ print(f"[BIOME] Starting server...", flush=True)
 import asyncio
 import base64
 import io
-import json
 import logging
+import os
+import queue
+import struct
+import threading
 import time
 import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 
@@ -33,6 +38,11 @@ logger = logging.getLogger("websocket_server")
 
 print("[BIOME] Basic imports done", flush=True)
 
+# Let the CUDA caching allocator grow its pool in place and never shrink it, so
+# once warmup has settled it, per-frame allocations are served from the cache
+# rather than cudaMalloc/cudaFree (must be set before torch loads)
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 try:
     print("[BIOME] Importing torch...", flush=True)
     import torch
@@ -50,6 +60,16 @@ try:
 
     print("[BIOME] PIL imported", flush=True)
 
+    print("[BIOME] Importing turbojpeg...", flush=True)
+    from turbojpeg import TJFLAG_FASTDCT, TJPF_RGB, TJSAMP_420, TurboJPEG
+
+    print("[BIOME] turbojpeg imported", flush=True)
+
+    print("[BIOME] Importing orjson...", flush=True)
+    import orjson
+
+    print("[BIOME] orjson imported", flush=True)
+
     print("[BIOME] Importing FastAPI...", flush=True)
     import uvicorn
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect
@@ -68,10 +88,22 @@ except Exception as e:
 # ============================================================================
 
 MODEL_URI = "Overworld/Waypoint-1-Small"
-QUANT = "w8a8"
+# "auto" picks FP8 on Ada/Hopper and plain BF16 elsewhere; set explicitly to
+# "fp8_e4m3", "w8a8" or None (BF16) to override
+QUANT = "auto"
 N_FRAMES = 4096
 DEVICE = "cuda"
-JPEG_QUALITY = 85
+JPEG_QUALITY = 85  # default; clients can override with ?quality=N on /ws
+# Encode CUDA frames on the GPU with nvJPEG. torchvision's CUDA encoder only
+# takes a quality; its subsampling/DCT settings are fixed. Set False to send
+# every frame through turbojpeg, where the 4:2:0 + fast-DCT tuning applies.
+NVJPEG_ENCODE = True
+WARMUP_FRAMES = 12  # extra frames generated during warmup to settle the allocator
+# Resend the last frame instead of running the model once input has been idle
+# (no buttons, no mouse) for IDLE_SKIP_TICKS control ticks. Off by default:
+# the world keeps evolving under null input, so idle frames aren't static.
+SKIP_IDLE_FRAMES = False
+IDLE_SKIP_TICKS = 2
 
 BUTTON_CODES = {}
 # A-Z keys
@@ -94,18 +126,36 @@ BUTTON_CODES["MOUSE_LEFT"] = 0x01
 BUTTON_CODES["MOUSE_RIGHT"] = 0x02
 BUTTON_CODES["MOUSE_MIDDLE"] = 0x04
 
+# One bit per button code, keyed by upper- and lower-case names so the control
+# path can OR masks together without calling .upper() on every button
+BUTTON_BITS = {}
+for name, code in BUTTON_CODES.items():
+    BUTTON_BITS[name] = BUTTON_BITS[name.lower()] = 1 << code
+
+
+def buttons_from_mask(mask: int) -> set[int]:
+    """Expand a button bitmap into a new set of the codes CtrlInput expects."""
+    codes = set()
+    while mask:
+        low = mask & -mask
+        codes.add(low.bit_length() - 1)
+        mask ^= low
+    return codes
+
 
 
 # Default prompt - describes the expected visual style
-DEFAULT_PROMPT = "First-person shooter gameplay footage from a true POV perspective, "
-"the camera locked to the player's eyes as assault rifles, carbines, "
-"machine guns, laser-sighted firearms, bullet-fed weapons, magazines, "
-"barrels, muzzles, tracers, ammo, and launchers dominate the frame, "
-"with constant gun handling, recoil, muzzle flash, shell ejection, "
-"and ballistic impacts. Continuous real-time FPS motion with no cuts, "
-"weapon-centric framing, realistic gun physics, authentic firearm "
-"materials, high-caliber ammunition, laser optics, iron sights, and "
-"relentless gun-driven action, rendered in ultra-realistic 4K at 60fps."
+DEFAULT_PROMPT = (
+    "First-person shooter gameplay footage from a true POV perspective, "
+    "the camera locked to the player's eyes as assault rifles, carbines, "
+    "machine guns, laser-sighted firearms, bullet-fed weapons, magazines, "
+    "barrels, muzzles, tracers, ammo, and launchers dominate the frame, "
+    "with constant gun handling, recoil, muzzle flash, shell ejection, "
+    "and ballistic impacts. Continuous real-time FPS motion with no cuts, "
+    "weapon-centric framing, realistic gun physics, authentic firearm "
+    "materials, high-caliber ammunition, laser optics, iron sights, and "
+    "relentless gun-driven action, rendered in ultra-realistic 4K at 60fps."
+)
 
 
 # ============================================================================
@@ -118,21 +168,67 @@ CtrlInput = None
 current_prompt = DEFAULT_PROMPT
 engine_warmed_up = False
 
+# Prompt encoder outputs keyed by prompt text, so reset_engine (run on every
+# connect and prompt change) doesn't re-encode an unchanged prompt
+PROMPT_CACHE_SIZE = 16
+_prompt_cache: dict[tuple, object] = {}
+
+# Pinned host buffer + CUDA event for frame readback, one per thread. Readback
+# and encode run back to back in the same call, so each thread only ever needs
+# one buffer, and separate threads (encoder, seed frame encode) never share it.
+_readback_state = threading.local()
+
+# All engine calls run on this one thread. The engine captures CUDA graphs
+# during warmup and they can only be replayed from the thread that captured
+# them; asyncio.to_thread would hop between pool workers and fall off the
+# graph path.
+_engine_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="engine")
+
+
+async def run_on_engine_thread(fn, *args, **kwargs):
+    """Run an engine call on the dedicated engine thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_engine_executor, lambda: fn(*args, **kwargs))
+
+
+JPEG_SOI = b"\xff\xd8"  # start-of-image marker every JPEG stream begins with
+
+
+def _decode_rgb(img_data: bytes):
+    """Decode image bytes to a contiguous HxWx3 uint8 RGB array."""
+    if _tj is not None and img_data[:2] == JPEG_SOI:
+        try:
+            return _tj.decode(img_data, pixel_format=TJPF_RGB)
+        except Exception as e:
+            # e.g. CMYK/Adobe JPEGs libjpeg-turbo can't convert to RGB
+            logger.info(f"turbojpeg decode failed, retrying with PIL: {e}")
+    # PNG/WebP/etc. (or no libjpeg-turbo) go through PIL
+    import numpy as np
+
+    return np.array(Image.open(io.BytesIO(img_data)).convert("RGB"))
+
+
+def _upload_seed(arr, target_size: tuple[int, int]) -> torch.Tensor:
+    """Upload a decoded uint8 image and resize it on the device to an HWC seed frame."""
+    # Only uint8 crosses the bus; the float copy for interpolate lives on the GPU
+    img = torch.from_numpy(arr).pin_memory().to(DEVICE, non_blocking=True)
+    if tuple(img.shape[:2]) != tuple(target_size):
+        img = F.interpolate(
+            img.permute(2, 0, 1).unsqueeze(0).float(),
+            size=target_size,
+            mode="bilinear",
+            align_corners=False,
+        )[0]
+        img = img.to(torch.uint8).permute(1, 2, 0)
+    # Fresh tensor per load: the previous seed may still be in use by the engine
+    return img.contiguous()
+
 
 def load_seed_from_base64(base64_data: str, target_size: tuple[int, int] = (360, 640)) -> torch.Tensor:
     """Load a seed frame from base64 encoded data."""
     try:
         img_data = base64.b64decode(base64_data)
-        img = Image.open(io.BytesIO(img_data)).convert("RGB")
-        import numpy as np
-
-        img_tensor = (
-            torch.from_numpy(np.array(img)).permute(2, 0, 1).unsqueeze(0).float()
-        )
-        frame = F.interpolate(
-            img_tensor, size=target_size, mode="bilinear", align_corners=False
-        )[0]
-        return frame.to(dtype=torch.uint8, device=DEVICE).permute(1, 2, 0).contiguous()
+        return _upload_seed(_decode_rgb(img_data), target_size)
     except Exception as e:
         print(f"[ERROR] Failed to load seed from base64: {e}")
         return None
@@ -143,24 +239,92 @@ def load_seed_from_url(url, target_size=(360, 640)):
     try:
         with urllib.request.urlopen(url, timeout=10) as response:
             img_data = response.read()
-        img = Image.open(io.BytesIO(img_data)).convert("RGB")
-        import numpy as np
-
-        img_tensor = (
-            torch.from_numpy(np.array(img)).permute(2, 0, 1).unsqueeze(0).float()
-        )
-        frame = F.interpolate(
-            img_tensor, size=target_size, mode="bilinear", align_corners=False
-        )[0]
-        return frame.to(dtype=torch.uint8, device=DEVICE).permute(1, 2, 0).contiguous()
+        return _upload_seed(_decode_rgb(img_data), target_size)
     except Exception as e:
         print(f"[ERROR] Failed to load seed from URL: {e}")
         return None
 
 
+# Quant name passed to WorldEngine for FP8. Not confirmed against the pinned
+# world-engine branch, so load_engine falls back to BF16 if it's rejected.
+FP8_QUANT = "fp8_e4m3"
+
+
+def select_quant():
+    """Pick the weight quantization for the GPU the engine will run on.
+
+    FP8 (E4M3) matmuls are native on compute capability 8.9+ (Ada/Hopper and
+    newer). Older cards get unquantized BF16: w8a8's dequant/requant overhead
+    makes it slower than BF16 at the batch-1 shapes we decode with.
+
+    Only DEVICE is inspected. With DEVICE = "cuda" that is the current device
+    (index 0 unless CUDA_VISIBLE_DEVICES says otherwise); the engine is a
+    single-GPU singleton, so no other device matters.
+    """
+    if torch.cuda.is_available() and torch.cuda.get_device_capability(DEVICE) >= (8, 9):
+        return FP8_QUANT
+    return None
+
+
+def _clone_tensors(value):
+    """Copy every tensor in an encoder output so callers can't mutate the cache."""
+    if isinstance(value, torch.Tensor):
+        return value.clone()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_clone_tensors(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _clone_tensors(v) for k, v in value.items()}
+    return value
+
+
+def _memoize_prompt_encoder(engine):
+    """Cache the engine's text encoder so repeated set_prompt calls are free.
+
+    Assumes WorldEngine keeps its text encoder as ``engine.prompt_encoder`` and
+    that set_prompt calls it with the raw prompt string(s). Neither is a public
+    API, so a missing encoder or non-text arguments disable/bypass the cache
+    with a warning rather than guessing.
+    """
+    encoder = getattr(engine, "prompt_encoder", None)
+    if encoder is None or not callable(getattr(encoder, "forward", None)):
+        logger.warning("      Prompt cache: engine exposes no prompt_encoder, disabled")
+        return
+    encode = encoder.forward
+
+    def text_key(value):
+        # Only plain text (or lists of it) is a safe key; anything else, e.g.
+        # pre-tokenized tensors, bypasses the cache
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+            return tuple(value)
+        raise TypeError
+
+    def cached_forward(*args, **kwargs):
+        try:
+            key = (
+                tuple(text_key(a) for a in args),
+                tuple(sorted((k, text_key(v)) for k, v in kwargs.items())),
+            )
+        except TypeError:
+            logger.warning("Prompt cache: encoder called with non-text args, bypassing")
+            return encode(*args, **kwargs)
+        if key not in _prompt_cache:
+            if len(_prompt_cache) >= PROMPT_CACHE_SIZE:
+                _prompt_cache.pop(next(iter(_prompt_cache)))
+            with torch.no_grad():
+                _prompt_cache[key] = encode(*args, **kwargs)
+        # Hand out copies: the engine may modify its embedding in place
+        return _clone_tensors(_prompt_cache[key])
+
+    # Instance attribute shadows the class method, and nn.Module.__call__ picks it up
+    encoder.forward = cached_forward
+    logger.info(f"      Prompt cache: enabled ({PROMPT_CACHE_SIZE} entries)")
+
+
 def load_engine():
     """Initialize the WorldEngine with configured model."""
-    global engine, seed_frame, CtrlInput
+    global engine, seed_frame, CtrlInput, QUANT
 
     logger.info("=" * 60)
     logger.info("BIOME ENGINE STARTUP")
@@ -176,6 +340,10 @@ def load_engine():
         f"[1/4] WorldEngine imported in {time.perf_counter() - import_start:.2f}s"
     )
 
+    auto_quant = QUANT == "auto"
+    if auto_quant:
+        QUANT = select_quant()
+
     logger.info(f"[2/4] Loading model: {MODEL_URI}")
     logger.info(f"      Quantization: {QUANT}")
     logger.info(f"      Device: {DEVICE}")
@@ -186,18 +354,33 @@ def load_engine():
     # scheduler_sigmas: diffusion denoising schedule (MUST end with 0.0)
     # ae_uri: VAE model for encoding/decoding frames
     model_start = time.perf_counter()
-    engine = WorldEngine(
-        MODEL_URI,
-        device=DEVICE,
-        model_config_overrides={
-            "n_frames": N_FRAMES,
-            "ae_uri": "OpenWorldLabs/owl_vae_f16_c16_distill_v0_nogan",
-            "scheduler_sigmas": [1.0, 0.8, 0.2, 0.0],
-        },
-        quant=QUANT,
-        dtype=torch.bfloat16,
-    )
+
+    def build_engine(quant):
+        return WorldEngine(
+            MODEL_URI,
+            device=DEVICE,
+            model_config_overrides={
+                "n_frames": N_FRAMES,
+                "ae_uri": "OpenWorldLabs/owl_vae_f16_c16_distill_v0_nogan",
+                "scheduler_sigmas": [1.0, 0.8, 0.2, 0.0],
+            },
+            quant=quant,
+            dtype=torch.bfloat16,
+        )
+
+    try:
+        engine = build_engine(QUANT)
+    except Exception as e:
+        # An auto-selected FP8 mode the engine doesn't support mustn't stop the
+        # server on exactly the GPUs it was meant to speed up
+        if not (auto_quant and QUANT is not None):
+            raise
+        logger.warning(f"[2/4] quant={QUANT!r} failed ({e}), retrying with BF16")
+        torch.cuda.empty_cache()
+        QUANT = None
+        engine = build_engine(QUANT)
     logger.info(f"[2/4] Model loaded in {time.perf_counter() - model_start:.2f}s")
+    _memoize_prompt_encoder(engine)
 
     # Seed frame will be provided by frontend via set_initial_seed message
     logger.info("[3/4] Seed frame: waiting for client to provide initial seed via base64")
@@ -215,16 +398,220 @@ def load_engine():
 # ============================================================================
 
 
-def frame_to_jpeg(frame: torch.Tensor, quality: int = JPEG_QUALITY) -> bytes:
-    """Convert frame tensor to JPEG bytes."""
-    if frame.dtype != torch.uint8:
-        frame = frame.clamp(0, 255).to(torch.uint8)
-    img = Image.fromarray(frame.cpu().numpy(), mode="RGB")
+# libjpeg-turbo encoder (SIMD DCT/Huffman). Falls back to PIL if the shared
+# library can't be located on this machine.
+try:
+    _tj = TurboJPEG()
+except Exception as e:
+    logger.warning(f"libjpeg-turbo unavailable, falling back to PIL encoder: {e}")
+    _tj = None
+
+# nvJPEG encoder via torchvision (CUDA tensors only). Disabled after the first
+# failure so we don't pay for a raised exception on every frame.
+_nvjpeg_enabled = NVJPEG_ENCODE
+
+
+def _to_u8(frame: torch.Tensor, chw: bool) -> torch.Tensor:
+    frame = frame.clamp(0, 255).to(torch.uint8)
+    return frame.permute(2, 0, 1).contiguous() if chw else frame.contiguous()
+
+
+# Inductor fuses clamp + cast + layout change into one elementwise kernel
+# (compiled lazily on first call, i.e. during warmup)
+_to_u8_fused = torch.compile(_to_u8, dynamic=False)
+_fused_enabled = True
+
+
+def to_u8(frame: torch.Tensor, chw: bool = False) -> torch.Tensor:
+    """Convert an HWC frame to contiguous uint8, HWC or (if chw) CHW."""
+    global _fused_enabled
+    if frame.dtype == torch.uint8 and not chw:
+        return frame
+    if frame.is_cuda and _fused_enabled:
+        try:
+            return _to_u8_fused(frame, chw)
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, using eager conversion: {e}")
+            _fused_enabled = False
+    return _to_u8(frame, chw)
+
+
+def _readback_frame(frame: torch.Tensor) -> torch.Tensor:
+    """Copy an HWC uint8 frame to host memory through this thread's pinned buffer.
+
+    Only used by the CPU encoder, i.e. when nvJPEG is unavailable. The returned
+    tensor is reused by the next readback on the same thread.
+    """
+    if not frame.is_cuda:
+        return frame.contiguous()
+    state = _readback_state
+    pinned = getattr(state, "pinned", None)
+    if pinned is None or pinned.shape != frame.shape:
+        pinned = state.pinned = torch.empty(
+            frame.shape, dtype=torch.uint8, pin_memory=True
+        )
+        state.event = torch.cuda.Event()
+    pinned.copy_(frame, non_blocking=True)
+    state.event.record()
+    state.event.synchronize()
+    return pinned
+
+
+def _encode_jpeg_cpu(frame: torch.Tensor, quality: int) -> bytes:
+    """Encode an HWC uint8 frame on the CPU with libjpeg-turbo (or PIL).
+
+    The 4:2:0 subsampling and fast DCT are stream-specific tuning that only
+    this path applies; the nvJPEG path uses torchvision's fixed settings.
+    """
+    arr = _readback_frame(frame).numpy()
+    if _tj is not None:
+        return _tj.encode(
+            arr,
+            quality=quality,
+            pixel_format=TJPF_RGB,
+            jpeg_subsample=TJSAMP_420,
+            flags=TJFLAG_FASTDCT,
+        )
+    img = Image.fromarray(arr, mode="RGB")
     buf = io.BytesIO()
     img.save(buf, format="JPEG", quality=quality)
     return buf.getvalue()
 
 
+def frame_to_jpeg(frame: torch.Tensor, quality: int = JPEG_QUALITY) -> bytes:
+    """Convert frame tensor to JPEG bytes.
+
+    Frames are HWC, as returned by gen_frame and the seed loaders, so the CPU
+    path copies them to the host as-is; only nvJPEG needs a CHW transpose.
+    CUDA frames are encoded on the GPU with nvJPEG so only the compressed
+    bitstream crosses the bus; everything else goes through the CPU encoder.
+    """
+    global _nvjpeg_enabled
+    if frame.is_cuda and _nvjpeg_enabled:
+        try:
+            buf = torchvision.io.encode_jpeg(to_u8(frame, chw=True), quality=quality)
+            return buf.cpu().numpy().tobytes()
+        except Exception as e:
+            logger.warning(f"nvJPEG encode unavailable, using CPU encoder: {e}")
+            _nvjpeg_enabled = False
+    return _encode_jpeg_cpu(to_u8(frame), quality)
+
+
+# Binary frame header: frame_id (u32), client_ts_ms (u64), gen_ms (u32), little-endian.
+# The raw JPEG bytes follow immediately after the 16-byte header.
+FRAME_HEADER = struct.Struct("<IQI")
+
+
+def parse_client_ts(ts) -> int:
+    """Coerce a control message's ts (seconds) to a u64 millisecond timestamp."""
+    try:
+        return min(max(0, int(float(ts) * 1000)), 2**64 - 1)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def pack_frame(jpeg: bytes, frame_id: int, client_ts_ms: int, gen_ms: float) -> bytes:
+    """Prefix JPEG bytes with the binary frame header."""
+    return FRAME_HEADER.pack(frame_id, client_ts_ms, int(gen_ms)) + jpeg
+
+
+SEND_TIMEOUT = 5.0  # seconds a frame may wait on a slow client before being dropped
+
+
+class FrameEncoder:
+    """Per-connection JPEG encoder thread.
+
+    Holds at most one pending frame; if the encoder falls behind, the older
+    frame is dropped in favour of the newest. The worker waits for each send
+    to finish before taking the next frame, so a slow client backs up this
+    queue (and triggers the drop) instead of piling sends onto the event loop.
+
+    Every item carries the session's reset_count from when it was queued;
+    frames generated before a reset/prompt change are dropped rather than
+    sent or cached for idle resends.
+    """
+
+    def __init__(self, session, websocket: WebSocket, loop):
+        self.session = session
+        self.websocket = websocket
+        self.loop = loop
+        self._queue: queue.Queue = queue.Queue(maxsize=1)
+        self._last = None  # (reset_count, jpeg) of the last frame sent
+        self._thread = threading.Thread(
+            target=self._run, name="jpeg-encoder", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, frame, frame_id, client_ts_ms, gen_ms):
+        """Queue a frame for encoding, replacing any frame still waiting."""
+        self._put((frame, frame_id, client_ts_ms, gen_ms, self.session.reset_count))
+
+    def has_frame(self) -> bool:
+        """Whether a frame from the current reset epoch is available to resend."""
+        last = self._last
+        return last is not None and last[0] == self.session.reset_count
+
+    def resend(self, frame_id, client_ts_ms):
+        """Queue a resend of the last frame, behind any frame still pending.
+
+        Skipped if a frame is already waiting, since that frame is newer.
+        """
+        try:
+            self._queue.put_nowait(
+                (None, frame_id, client_ts_ms, 0, self.session.reset_count)
+            )
+        except queue.Full:
+            pass
+
+    async def close(self):
+        """Stop the worker once its current frame is done."""
+        self._put(None)
+        await asyncio.to_thread(self._thread.join, SEND_TIMEOUT)
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            frame, frame_id, client_ts_ms, gen_ms, reset_count = item
+            if reset_count != self.session.reset_count:
+                continue  # generated before the last reset
+            try:
+                if frame is None:
+                    if not self.has_frame():
+                        continue
+                    jpeg = self._last[1]
+                else:
+                    jpeg = frame_to_jpeg(frame, self.session.jpeg_quality)
+                    if reset_count != self.session.reset_count:
+                        continue  # reset happened while encoding
+                    self._last = (reset_count, jpeg)
+                fut = asyncio.run_coroutine_threadsafe(
+                    self.websocket.send_bytes(
+                        pack_frame(jpeg, frame_id, client_ts_ms, gen_ms)
+                    ),
+                    self.loop,
+                )
+                try:
+                    fut.result(timeout=SEND_TIMEOUT)
+                except TimeoutError:
+                    fut.cancel()
+                    logger.warning(f"[ENC] Send of frame {frame_id} timed out")
+            except Exception as e:
+                logger.error(f"[ENC] Failed to encode/send frame {frame_id}: {e}")
+
+
 # ============================================================================
 # Session Management
 # ============================================================================
@@ -236,6 +623,9 @@ class Session:
 
     frame_count: int = 0
     max_frames: int = N_FRAMES - 2
+    jpeg_quality: int = JPEG_QUALITY
+    reset_count: int = 0  # bumped by every reset; tags queued frames
+    idle_ticks: int = 0
 
 
 # ============================================================================
@@ -249,7 +639,8 @@ async def lifespan(app: FastAPI):
     # Startup
     load_engine()
     yield
-    # Shutdown (if needed in the future)
+    # Shutdown
+    _engine_executor.shutdown(wait=False)
 
 
 app = FastAPI(title="WorldEngine WebSocket Server", lifespan=lifespan)
@@ -263,6 +654,11 @@ async def health():
             "model": MODEL_URI,
             "quant": QUANT,
             "engine_loaded": engine is not None,
+            "cuda_alloc_retries": (
+                torch.cuda.memory_stats().get("num_alloc_retries", 0)
+                if torch.cuda.is_available()
+                else None
+            ),
         }
     )
 
@@ -284,30 +680,45 @@ async def websocket_endpoint(websocket: WebSocket):
     Protocol:
         Server -> Client:
             {"type": "status", "code": str}
-            {"type": "frame", "data": base64_jpeg, "frame_id": int, "client_ts": float, "gen_ms": float}
             {"type": "error", "message": str}
+            binary: <frame_id:u32><client_ts_ms:u64><gen_ms:u32> + raw JPEG (see FRAME_HEADER)
 
         Client -> Server:
             {"type": "control", "buttons": [str], "mouse_dx": float, "mouse_dy": float, "ts": float}
             {"type": "reset"}
 
+    Query params:
+        quality: JPEG quality 1-100 (default JPEG_QUALITY)
+
     Status codes: init, loading, ready, reset
     """
     global seed_frame, current_prompt, engine_warmed_up
     client_host = websocket.client.host if websocket.client else "unknown"
+    reader_task = None
+    encoder = None
     logger.info(f"Client connected: {client_host}")
 
     await websocket.accept()
     session = Session()
+    loop = asyncio.get_running_loop()
+    try:
+        session.jpeg_quality = min(
+            100, max(1, int(websocket.query_params.get("quality", JPEG_QUALITY)))
+        )
+    except ValueError:
+        pass
 
     async def send_json(data: dict):
-        await websocket.send_text(json.dumps(data))
+        # Sent as text: binary messages are reserved for video frames
+        await websocket.send_text(orjson.dumps(data).decode())
 
     async def reset_engine():
-        await asyncio.to_thread(engine.reset)
-        await asyncio.to_thread(engine.append_frame, seed_frame)
-        await asyncio.to_thread(engine.set_prompt, current_prompt)
+        await run_on_engine_thread(engine.reset)
+        await run_on_engine_thread(engine.append_frame, seed_frame)
+        await run_on_engine_thread(engine.set_prompt, current_prompt)
         session.frame_count = 0
+        session.reset_count += 1
+        session.idle_ticks = 0
         await send_json({"type": "status", "code": Status.RESET})
         logger.info(f"[{client_host}] Engine Reset")
 
@@ -320,14 +731,14 @@ async def websocket_endpoint(websocket: WebSocket):
         while seed_frame is None:
             try:
                 raw = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                msg = json.loads(raw)
+                msg = orjson.loads(raw)
                 msg_type = msg.get("type")
 
                 if msg_type == "set_initial_seed":
                     seed_base64 = msg.get("seed_base64")
                     if seed_base64:
                         logger.info(f"[{client_host}] Received initial seed ({len(seed_base64)} chars)")
-                        loaded_frame = load_seed_from_base64(seed_base64)
+                        loaded_frame = await asyncio.to_thread(load_seed_from_base64, seed_base64)
                         if loaded_frame is not None:
                             seed_frame = loaded_frame
                             logger.info(f"[{client_host}] Initial seed loaded successfully")
@@ -379,14 +790,31 @@ async def websocket_endpoint(websocket: WebSocket):
                     "[5/5] Step 4: Generating first frame (compiling CUDA graphs)..."
                 )
                 gen_start = time.perf_counter()
-                _ = engine.gen_frame(ctrl=CtrlInput(button=set(), mouse=(0.0, 0.0)))
+                frame = engine.gen_frame(ctrl=CtrlInput(button=set(), mouse=(0.0, 0.0)))
                 logger.info(
                     f"[5/5] Step 4: First frame generated in {time.perf_counter() - gen_start:.2f}s"
                 )
 
+                # Compiles the fused uint8 conversion used by frame_to_jpeg
+                encode_start = time.perf_counter()
+                frame_to_jpeg(frame)
+                logger.info(
+                    f"[5/5] Step 4: First frame encoded in {time.perf_counter() - encode_start:.2f}s"
+                )
+
+                logger.info(
+                    f"[5/5] Step 5: Generating {WARMUP_FRAMES} frames to settle the CUDA allocator..."
+                )
+                settle_start = time.perf_counter()
+                for _ in range(WARMUP_FRAMES):
+                    engine.gen_frame(ctrl=CtrlInput(button=set(), mouse=(0.0, 0.0)))
+                logger.info(
+                    f"[5/5] Step 5: Allocator settled in {time.perf_counter() - settle_start:.2f}s"
+                )
+
                 return time.perf_counter() - warmup_start
 
-            warmup_time = await asyncio.to_thread(do_warmup)
+            warmup_time = await run_on_engine_thread(do_warmup)
             logger.info("=" * 60)
             logger.info(f"[5/5] WARMUP COMPLETE - Total time: {warmup_time:.2f}s")
             logger.info("=" * 60)
@@ -395,65 +823,68 @@ async def websocket_endpoint(websocket: WebSocket):
         await send_json({"type": "status", "code": Status.INIT})
 
         logger.info(f"[{client_host}] Calling engine.reset()...")
-        await asyncio.to_thread(engine.reset)
+        await run_on_engine_thread(engine.reset)
 
         await send_json({"type": "status", "code": Status.LOADING})
 
         logger.info(f"[{client_host}] Calling append_frame...")
-        await asyncio.to_thread(engine.append_frame, seed_frame)
+        await run_on_engine_thread(engine.append_frame, seed_frame)
 
         # Send initial frame so client has something to display
-        jpeg = await asyncio.to_thread(frame_to_jpeg, seed_frame)
-        await send_json(
-            {
-                "type": "frame",
-                "data": base64.b64encode(jpeg).decode("ascii"),
-                "frame_id": 0,
-                "client_ts": 0,
-                "gen_ms": 0,
-            }
-        )
+        jpeg = await asyncio.to_thread(frame_to_jpeg, seed_frame, session.jpeg_quality)
+        await websocket.send_bytes(pack_frame(jpeg, 0, 0, 0))
 
         await send_json({"type": "status", "code": Status.READY})
         logger.info(f"[{client_host}] Ready for game loop")
         paused = False
 
-        # Helper to drain all pending messages and return only the latest control input
-        async def get_latest_control():
-            """Drain the message queue and return only the most recent control input."""
-            latest_control_msg = None
-            skipped_count = 0
+        # The button set is only rebuilt when the bitmap changes. A new set is
+        # built rather than mutated, so any CtrlInput the engine keeps around
+        # still sees the buttons it was created with.
+        button_mask = 0
+        buttons = set()
+
+        # Background reader: coalesces control messages into a single latest
+        # slot and queues everything else, so the game loop never polls
+        latest_control = None
+        pending_msgs = deque()
+        inbox = asyncio.Event()
 
+        async def reader():
+            nonlocal latest_control
+            try:
+                while True:
+                    msg = orjson.loads(await websocket.receive_text())
+                    if msg.get("type", "control") == "control":
+                        latest_control = msg
+                    else:
+                        pending_msgs.append(msg)
+                    inbox.set()
+            finally:
+                # Wake the game loop so it sees the disconnect/error
+                inbox.set()
+
+        reader_task = asyncio.create_task(reader())
+        encoder = FrameEncoder(session, websocket, loop)
+
+        async def next_message():
+            """Return the next non-control message, else the most recent control input."""
+            nonlocal latest_control
             while True:
-                try:
-                    raw = await asyncio.wait_for(
-                        websocket.receive_text(), timeout=0.001
-                    )
-                    msg = json.loads(raw)
-
-                    # Handle non-control messages immediately
-                    msg_type = msg.get("type", "control")
-                    if msg_type != "control":
-                        return msg  # Return special messages immediately
-
-                    # For control messages, keep only the latest
-                    if latest_control_msg is not None:
-                        skipped_count += 1
-                    latest_control_msg = msg
-
-                except asyncio.TimeoutError:
-                    # No more messages in queue
-                    # if skipped_count > 0:
-                    #     logger.info(f"[{client_host}] Skipped {skipped_count} queued inputs, using latest")
-                    return latest_control_msg
-                except WebSocketDisconnect:
-                    raise
+                if pending_msgs:
+                    return pending_msgs.popleft()
+                if latest_control is not None:
+                    msg, latest_control = latest_control, None
+                    return msg
+                if reader_task.done():
+                    reader_task.result()  # re-raises WebSocketDisconnect
+                    raise WebSocketDisconnect()
+                inbox.clear()
+                await inbox.wait()
 
         while True:
             try:
-                msg = await get_latest_control()
-                if msg is None:
-                    continue
+                msg = await next_message()
             except WebSocketDisconnect:
                 logger.info(f"[{client_host}] Client disconnected")
                 break
@@ -489,7 +920,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     )
                     try:
                         if seed_url:
-                            url_frame = load_seed_from_url(seed_url)
+                            url_frame = await asyncio.to_thread(load_seed_from_url, seed_url)
                             if url_frame is not None:
                                 seed_frame = url_frame
                                 logger.info("[RECV] Seed frame loaded from URL")
@@ -506,7 +937,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     logger.info(f"[RECV] set_initial_seed received ({len(seed_base64) if seed_base64 else 0} chars)")
                     try:
                         if seed_base64:
-                            loaded_frame = load_seed_from_base64(seed_base64)
+                            loaded_frame = await asyncio.to_thread(load_seed_from_base64, seed_base64)
                             if loaded_frame is not None:
                                 seed_frame = loaded_frame
                                 logger.info("[RECV] Seed frame updated from base64")
@@ -520,14 +951,29 @@ async def websocket_endpoint(websocket: WebSocket):
                 case "control":
                     if paused:
                         continue
-                    buttons = {
-                        BUTTON_CODES[b.upper()]
-                        for b in msg.get("buttons", [])
-                        if b.upper() in BUTTON_CODES
-                    }
+                    new_mask = 0
+                    for b in msg.get("buttons", ()):
+                        new_mask |= BUTTON_BITS.get(b, 0)
+                    if new_mask != button_mask:
+                        button_mask = new_mask
+                        buttons = buttons_from_mask(button_mask)
                     mouse_dx = float(msg.get("mouse_dx", 0))
                     mouse_dy = float(msg.get("mouse_dy", 0))
-                    client_ts = msg.get("ts", 0)
+                    client_ts_ms = parse_client_ts(msg.get("ts", 0))
+
+                    if button_mask == 0 and mouse_dx == 0 and mouse_dy == 0:
+                        session.idle_ticks += 1
+                    else:
+                        session.idle_ticks = 0
+                    if (
+                        SKIP_IDLE_FRAMES
+                        and session.idle_ticks > IDLE_SKIP_TICKS
+                        and encoder.has_frame()
+                    ):
+                        # Goes through the encoder queue so it can't overtake a
+                        # newer frame; same frame_id as the engine hasn't advanced
+                        encoder.resend(session.frame_count, client_ts_ms)
+                        continue
 
                     if session.frame_count >= session.max_frames:
                         logger.info(f"[{client_host}] Auto-reset at frame limit")
@@ -536,21 +982,16 @@ async def websocket_endpoint(websocket: WebSocket):
                     ctrl = CtrlInput(button=buttons, mouse=(mouse_dx, mouse_dy))
 
                     t0 = time.perf_counter()
-                    frame = await asyncio.to_thread(engine.gen_frame, ctrl=ctrl)
+                    frame = await run_on_engine_thread(engine.gen_frame, ctrl=ctrl)
                     gen_time = (time.perf_counter() - t0) * 1000
 
                     session.frame_count += 1
 
-                    # Encode and send frame with timing info
-                    jpeg = await asyncio.to_thread(frame_to_jpeg, frame)
-                    await send_json(
-                        {
-                            "type": "frame",
-                            "data": base64.b64encode(jpeg).decode("ascii"),
-                            "frame_id": session.frame_count,
-                            "client_ts": client_ts,
-                            "gen_ms": gen_time,
-                        }
+                    # Encode and send on the encoder thread so the next frame can
+                    # be generated meanwhile. Clone since the engine may reuse its
+                    # output buffer on the next gen_frame call.
+                    encoder.submit(
+                        frame.clone(), session.frame_count, client_ts_ms, gen_time
                     )
 
                     # Logging
@@ -566,6 +1007,10 @@ async def websocket_endpoint(websocket: WebSocket):
         except Exception:
             pass
     finally:
+        if reader_task is not None:
+            reader_task.cancel()
+        if encoder is not None:
+            await encoder.close()
         logger.info(f"[{client_host}] Disconnected (frames: {session.frame_count})")
 
 
@@ -581,10 +1026,17 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=7987, help="Port to bind to")
     args = parser.parse_args()
 
+    # Single worker: the engine is a process-wide CUDA singleton.
+    # uvloop has no Windows build, so fall back to the stdlib loop there.
     uvicorn.run(
         app,
         host=args.host,
         port=args.port,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        ws="websockets",
+        workers=1,
+        access_log=False,
         ws_ping_interval=300,
         ws_ping_timeout=300,
     )
@@ -80,7 +80,7 @@ const VideoContainer = () => {
       <div className="video-container-inner">
         {!showMedia && <PortalBackgrounds />}
 
-        {/* Canvas for WebSocket base64 frames */}
+        {/* Canvas for WebSocket JPEG frames */}
         <canvas ref={handleCanvasRef} width={1280} height={720} className="streaming-frame" style={mediaStyle} />
 
         <PauseOverlay isActive={settingsOpen && isStreaming && !isShuttingDown} />
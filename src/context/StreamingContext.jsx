@@ -426,6 +426,7 @@ export const StreamingProvider = ({ children }) => {
       lastFpsUpdateRef.current = now
     }
 
+    const url = URL.createObjectURL(frame)
     const img = new Image()
     img.onload = () => {
       if (canvas.width !== img.width || canvas.height !== img.height) {
@@ -433,8 +434,10 @@ export const StreamingProvider = ({ children }) => {
         canvas.height = img.height
       }
       ctx.drawImage(img, 0, 0)
+      URL.revokeObjectURL(url)
     }
-    img.src = `data:image/jpeg;base64,${frame}`
+    img.onerror = () => URL.revokeObjectURL(url)
+    img.src = url
   }, [frame, canvasReady])
 
   // Input loop at 60hz
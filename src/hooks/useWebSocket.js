@@ -3,6 +3,9 @@ import { createLogger } from '../utils/logger'
 
 const log = createLogger('WebSocket')
 
+// Binary frame header: frame_id (u32), client_ts_ms (u64), gen_ms (u32), little-endian
+const FRAME_HEADER_BYTES = 16
+
 export const useWebSocket = () => {
   const [connectionState, setConnectionState] = useState('disconnected')
   const [frame, setFrame] = useState(null)
@@ -46,6 +49,7 @@ export const useWebSocket = () => {
 
     log.info('Connecting to', wsUrl)
     const ws = new WebSocket(wsUrl)
+    ws.binaryType = 'arraybuffer'
     wsRef.current = ws
 
     ws.onopen = () => {
@@ -55,6 +59,18 @@ export const useWebSocket = () => {
     }
 
     ws.onmessage = (event) => {
+      // Video frames arrive as binary: 16-byte header followed by raw JPEG bytes
+      if (event.data instanceof ArrayBuffer) {
+        const view = new DataView(event.data)
+        const genMs = view.getUint32(12, true)
+        setFrame(new Blob([new Uint8Array(event.data, FRAME_HEADER_BYTES)], { type: 'image/jpeg' }))
+        setFrameId(view.getUint32(0, true))
+        if (genMs) {
+          setGenTime(genMs)
+        }
+        return
+      }
+
       try {
         const msg = JSON.parse(event.data)
 
@@ -72,14 +88,6 @@ export const useWebSocket = () => {
             }
             break
 
-          case 'frame':
-            setFrame(msg.data)
-            setFrameId(msg.frame_id)
-            if (msg.gen_ms) {
-              setGenTime(Math.round(msg.gen_ms))
-            }
-            break
-
           case 'stats':
             // Handle stats messages
             if (msg.gentime !== undefined) {